@@ -10,15 +10,36 @@
 ##################################################
 
 import requests as reqs
-from bs4 import BeautifulSoup
-from socketIO_client import SocketIO
-import json
+from requests.adapters import HTTPAdapter
+from lxml import html as lxml_html
+import os
 import uuid
+import html
+import tempfile
+import shutil
+import threading
 import time
 import re
 from itertools import count
+from concurrent.futures import ThreadPoolExecutor
 from websockets.sync.client import connect
 import logging
+
+try:
+    # orjson parses bytes directly and is considerably faster on large payloads
+    import orjson
+
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj):
+        return orjson.dumps(obj).decode()
+except ImportError:
+    import json
+
+    _json_loads = json.loads
+    _json_dumps = json.dumps
+
+
 logger = logging.getLogger('websockets')
 logger.setLevel(logging.DEBUG)
 logger.addHandler(logging.StreamHandler())
@@ -35,6 +56,53 @@ COMPILE_URL = "https://www.overleaf.com/project/{}/compile?enable_pdf_caching=tr
 BASE_URL = "https://www.overleaf.com"  # The Overleaf Base URL
 PATH_SEP = "/"  # Use hardcoded path separator for both windows and posix system
 SOCKETIO_PATH = "socket.io/1"
+# The dashboard meta tag whose content holds the JSON blob of the user's projects
+PROJECTS_META_XPATH = '//meta[contains(@content, \'"projects"\')]/@content'
+PROJECTS_META_BYTES_RE = re.compile(rb'<meta[^>]+content="([^"]*&quot;projects&quot;[^"]*)"', re.I)
+HTTP_POOL_CONNECTIONS = 4  # Number of hosts to keep connection pools for
+HTTP_POOL_MAXSIZE = 8  # Keep-alive connections per host, also the default number of parallel uploads
+DOWNLOAD_CHUNK_SIZE = 1 << 16  # Bytes read from the network at once when streaming downloads
+PROJECTS_CACHE_TTL = 30  # Seconds the parsed project list is reused before the dashboard is fetched again
+# socket.io 0.9 frame: <code>:[<message id>[+]]:[:[<ack id>[+]]<data>]
+SOCKETIO_FRAME_RE = re.compile(r"(\d):(?:(\d+)(\+?))?:(?::(?:(\d+)(\+?))?(.*))?")
+
+
+def _jloads(response):
+    # Parse the raw body bytes, unlike response.json() which decodes them to str first
+    return _json_loads(response.content)
+
+
+def _parse_frame(frame):
+    """
+    Split a socket.io frame into its fields, the same groups SOCKETIO_FRAME_RE yields
+    Returns: (code, await_id, await_mult, answer_id, answer_mult, data)
+    """
+    parts = frame.split(':', 3)
+    if len(parts) < 3 or len(parts[0]) != 1 or not parts[0].isdigit() or parts[2]:
+        # Not the plain layout (e.g. an endpoint is set), let the regex deal with it
+        return SOCKETIO_FRAME_RE.match(frame).groups()
+
+    code, message_id = parts[0], parts[1]
+    if message_id:
+        await_mult = '+' if message_id.endswith('+') else ''
+        await_id = message_id[:-1] if await_mult else message_id
+        if not await_id.isdigit():
+            return SOCKETIO_FRAME_RE.match(frame).groups()
+    else:
+        await_id = await_mult = None
+
+    if len(parts) == 3:
+        return code, await_id, await_mult, None, None, None
+
+    payload = parts[3]
+    i = 0
+    while i < len(payload) and payload[i].isdigit():
+        i += 1
+    if not i:
+        return code, await_id, await_mult, None, None, payload
+    answer_mult = '+' if payload[i:i + 1] == '+' else ''
+    return code, await_id, await_mult, payload[:i], answer_mult, payload[i + len(answer_mult):]
+
 
 class OverleafClient(object):
     """
@@ -51,9 +119,48 @@ class OverleafClient(object):
                 if all(p.get(k) == v for k, v in more_attrs.items()):
                     yield p
 
-    def __init__(self, cookie=None, csrf=None):
-        self._cookie = cookie  # Store the cookie for authenticated requests
-        self._csrf = csrf  # Store the CSRF token since it is needed for some requests
+    def __init__(self, cookie=None, csrf=None, pool_maxsize=HTTP_POOL_MAXSIZE):
+        self._projects_cache = None  # Project list parsed from the dashboard
+        self._projects_ts = 0  # When the project list was fetched (time.monotonic)
+        self._by_name_cache = {}  # Active projects of the cached list by name
+        self._folder_idx = {}  # Name indices of remote folder lists, see _folder_index
+        self._folder_lock = threading.Lock()  # Serializes folder creation between concurrent uploads
+        # Cache-buster for the socket.io handshake, randomly seeded so separate runs don't repeat a URL
+        self._cb_counter = int.from_bytes(os.urandom(4), "big") & 0x7fffffff
+
+        # Reuse one keep-alive connection pool for all requests instead of a new TLS handshake per call, sized for
+        # as many requests as are made in parallel
+        self._session = reqs.Session()
+        self._session.mount("https://", HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS,
+                                                    pool_maxsize=pool_maxsize))
+
+        self._cookie = None  # Store the cookie for authenticated requests
+        self._cookie_header = None  # The cookie as a Cookie header string, for the socket.io handshake
+        if cookie is not None:
+            self._set_cookie(cookie)
+        self.csrf = csrf  # Store the CSRF token since it is needed for some requests
+
+    @property
+    def csrf(self):
+        return self._csrf
+
+    @csrf.setter
+    def csrf(self, csrf):
+        # Sent as a default header of the session instead of being passed on every call
+        self._csrf = csrf
+        if csrf is None:
+            self._session.headers.pop("X-Csrf-Token", None)
+        else:
+            self._session.headers["X-Csrf-Token"] = csrf
+
+    def _set_cookie(self, cookie):
+        """
+        Use a new authentication cookie (dict or CookieJar) for all following requests
+        """
+        self._cookie = cookie
+        self._session.cookies.update(cookie)
+        self._cookie_header = "; ".join(f"{name}={cookie[name]}" for name in ("GCLB", "overleaf_session2")
+                                        if name in cookie)
 
     def login(self, username, password):
         """
@@ -63,52 +170,85 @@ class OverleafClient(object):
         Returns: Dict of cookie and CSRF
         """
 
-        get_login = reqs.get(LOGIN_URL)
-        self._csrf = BeautifulSoup(get_login.content, 'html.parser').find(
-            'input', {'name': '_csrf'}).get('value')
+        get_login = self._session.get(LOGIN_URL)
+        # str() drops lxml's smart string, which would keep the whole parsed page alive
+        self.csrf = str(lxml_html.fromstring(get_login.content).xpath('//input[@name="_csrf"]/@value')[0])
         login_json = {
             "_csrf": self._csrf,
             "email": username,
             "password": password
         }
-        post_login = reqs.post(LOGIN_URL, json=login_json,
-                               cookies=get_login.cookies)
+        post_login = self._session.post(LOGIN_URL, json=login_json)
 
         # On a successful authentication the Overleaf API returns a new authenticated cookie.
         # If the cookie is different than the cookie of the GET request the authentication was successful
         if post_login.status_code == 200 and get_login.cookies["overleaf_session2"] != post_login.cookies[
             "overleaf_session2"]:
-            self._cookie = post_login.cookies
+            cookie = post_login.cookies
 
             # Enrich cookie with GCLB cookie from GET request above
-            self._cookie['GCLB'] = get_login.cookies['GCLB']
+            cookie['GCLB'] = get_login.cookies['GCLB']
+            self._set_cookie(cookie)
 
             # CSRF changes after making the login request, new CSRF token will be on the projects page
-            projects_page = reqs.get(PROJECT_URL, cookies=self._cookie)
-            self._csrf = BeautifulSoup(projects_page.content, 'html.parser').find('meta', {'name': 'ol-csrfToken'}) \
-                .get('content')
+            projects_page = self._session.get(PROJECT_URL)
+            self.csrf = str(lxml_html.fromstring(projects_page.content).xpath(
+                '//meta[@name="ol-csrfToken"]/@content')[0])
 
             return {"cookie": self._cookie, "csrf": self._csrf}
 
-    def all_projects(self):
+    def _fetch_projects(self):
         """
-        Get all of a user's active projects (= not archived and not trashed)
-        Returns: List of project objects
+        Fetch the dashboard and extract the project list from it, bypassing the cache
+        Returns: List of all project objects (including archived and trashed ones)
         """
-        projects_page = reqs.get(PROJECT_URL, cookies=self._cookie)
+        projects_page = self._session.get(PROJECT_URL)
         #json_content = json.loads(
         #    BeautifulSoup(projects_page.content, 'html.parser').find('meta', {'name': 'ol-projects'}).get('content'))
         #)
         #json_content = json.loads(
         #    BeautifulSoup(projects_page.content, 'html.parser').find('meta', {'name': 'ol-prefetchedProjectsBlob'}).get('content')).get('projects')
-        json_content = json.loads(
-                BeautifulSoup(
-                    projects_page.content, 'html.parser'
-                ).find(
-                    'meta', {'content': re.compile('\\{.*"projects".*\\}')}
-                ).get('content')
-        ).get('projects')
-        return list(OverleafClient.filter_projects(json_content))
+
+        # Pick the meta tag straight out of the raw page, only parsing the HTML if the markup is unexpected
+        match = PROJECTS_META_BYTES_RE.search(projects_page.content)
+        if match:
+            meta_content = html.unescape(match.group(1).decode())
+        else:
+            # A plain str, orjson rejects lxml's str subclass
+            meta_content = str(lxml_html.fromstring(projects_page.content).xpath(PROJECTS_META_XPATH)[0])
+        json_content = _json_loads(meta_content).get('projects')
+
+        self._projects_cache = json_content
+        self._projects_ts = time.monotonic()
+        # Index the active projects by name, the first project wins if names are shared
+        self._by_name_cache = {}
+        for p in OverleafClient.filter_projects(json_content):
+            self._by_name_cache.setdefault(p.get("name"), p)
+        return json_content
+
+    def _cached_projects(self):
+        """
+        Get the project list, only fetching the dashboard again once the cache has expired
+        Returns: List of all project objects (including archived and trashed ones)
+        """
+        if self._projects_cache is None or time.monotonic() - self._projects_ts >= PROJECTS_CACHE_TTL:
+            return self._fetch_projects()
+        return self._projects_cache
+
+    def refresh_projects(self):
+        """
+        Invalidate the cached project list so the next query fetches the dashboard again
+        """
+        self._projects_cache = None
+        self._projects_ts = 0
+        self._by_name_cache = {}
+
+    def all_projects(self):
+        """
+        Get all of a user's active projects (= not archived and not trashed)
+        Returns: List of project objects
+        """
+        return list(OverleafClient.filter_projects(self._cached_projects()))
 
     def get_project(self, project_name):
         """
@@ -116,32 +256,31 @@ class OverleafClient(object):
         Params: project_name, the name of the project
         Returns: project object
         """
+        self._cached_projects()
+        return self._by_name_cache.get(project_name)
 
-        projects_page = reqs.get(PROJECT_URL, cookies=self._cookie)
-        #json_content = json.loads(
-        #    BeautifulSoup(projects_page.content, 'html.parser').find('meta', {'name': 'ol-projects'}).get('content'))
-        #)
-        #json_content = json.loads(
-        #    BeautifulSoup(projects_page.content, 'html.parser').find('meta', {'name': 'ol-prefetchedProjectsBlob'}).get('content')).get('projects')
-        json_content = json.loads(
-                BeautifulSoup(
-                    projects_page.content, 'html.parser'
-                ).find(
-                    'meta', {'content': re.compile('\\{.*"projects".*\\}')}
-                ).get('content')
-        ).get('projects')
-
-        return next(OverleafClient.filter_projects(json_content, {"name": project_name}), None)
-
-    def download_project(self, project_id):
+    def download_project(self, project_id, dest=None):
         """
         Download project in zip format
-        Params: project_id, the id of the project
-        Returns: bytes string (zip file)
+        Params:
+        project_id: the id of the project
+        dest: binary file object the zip file is written to, a temporary file if not given
+        Returns: file object (zip file), rewound to the start if no dest was given
         """
-        r = reqs.get(DOWNLOAD_URL.format(project_id),
-                     stream=True, cookies=self._cookie)
-        return r.content
+        if dest is None:
+            # Not a SpooledTemporaryFile, ZipFile needs seekable() which it lacks before Python 3.11
+            dest = tempfile.TemporaryFile()
+            rewind = True
+        else:
+            rewind = False
+
+        with self._session.get(DOWNLOAD_URL.format(project_id), stream=True) as r:
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                dest.write(chunk)
+
+        if rewind:
+            dest.seek(0)
+        return dest
 
     def create_folder(self, project_id, parent_folder_id, folder_name):
         """
@@ -159,15 +298,14 @@ class OverleafClient(object):
             "parent_folder_id": parent_folder_id,
             "name": folder_name
         }
-        headers = {
-            "X-Csrf-Token": self._csrf
-        }
-        r = reqs.post(FOLDER_URL.format(project_id),
-                      cookies=self._cookie, headers=headers, json=params)
+        r = self._session.post(FOLDER_URL.format(project_id), json=params)
 
-        if r.ok:
-            return json.loads(r.content)
-        elif r.status_code == str(400):
+        if r.status_code == 204:
+            # Nothing to parse
+            return
+        elif r.ok:
+            return _jloads(r)
+        elif r.status_code == 400:
             # Folder already exists
             return
         else:
@@ -182,57 +320,87 @@ class OverleafClient(object):
 
         Returns: project details
         """
-        project_infos = None
-
-        # Callback function for the joinProject emitter
-        def set_project_infos(a, project_infos_dict, c, d):
-            # Set project_infos variable in outer scope
-            nonlocal project_infos
-            project_infos = project_infos_dict
-
-        # Convert cookie from CookieJar to string
-        cookie = f"GCLB={self._cookie['GCLB']}; overleaf_session2={self._cookie['overleaf_session2']}"
+        cookie = self._cookie_header
 
-        channel_info = reqs.get(
-            f"{BASE_URL}/{SOCKETIO_PATH}/?t={int(time.time())}",
+        # The t parameter only busts caches, a counter from a random seed is enough
+        t = self._cb_counter = (self._cb_counter + 1) & 0x7fffffff
+        channel_info = self._session.get(
+            f"{BASE_URL}/{SOCKETIO_PATH}/?t={t}",
             headers={'Cookie': cookie}
         ).text.split(':')[0]
 
         socket_url = f'{BASE_URL}/{SOCKETIO_PATH}/websocket/{channel_info}'.replace('http', 'ws')
         command_count = count(1)
-        codere = re.compile(r"(\d):(?:(\d+)(\+?))?:(?::(?:(\d+)(\+?))?(.*))?")
-
 
         def send_cmd(ws, cmd):
-            cmd_msg = f'5:{str(next(command_count))}+::{json.dumps(cmd)}'
-            ws.send(cmd_msg)
+            cmd_id = str(next(command_count))
+            ws.send(f'5:{cmd_id}+::{_json_dumps(cmd)}')
+            return cmd_id
 
         def read_response(ws):
             response = ws.recv()
+            # Answer heartbeats without parsing them, they carry no payload
+            while response.startswith('2:'):
+                ws.send('2::')
+                response = ws.recv()
 
-            code, await_id, await_mult, answer_id, answer_mult, data = codere.match(response).groups()
-            return code, await_id, await_mult, answer_id, answer_mult, data 
-
-        def send_recieve(ws, cmd):
-            send_cmd(ws, cmd)
-            return read_response(ws)
+            return _parse_frame(response)
 
-        with connect(socket_url, additional_headers={'Cookie': cookie}) as websocket:
+        # The joinProject answer carries the whole folder tree in one frame, so don't cap the message size
+        with connect(socket_url, additional_headers={'Cookie': cookie}, max_size=None) as websocket:
+            # Wait for the server to acknowledge the connection
             read_response(websocket)
+            join_id = send_cmd(websocket, {"name": "joinProject", "args": [{"project_id": project_id}]})
+
+            while True:
+                code, _, _, answer_id, _, data = read_response(websocket)
+                if code in ('0', '7'):
+                    # Disconnected or errored before the project was joined
+                    raise reqs.ConnectionError(data)
+                if code == '6' and answer_id == join_id:
+                    # The acknowledgement arguments are error, project, permissions level and protocol version
+                    error, project_infos = _json_loads(data)[:2]
+                    if error:
+                        raise reqs.ConnectionError(error)
+                    return project_infos
+
+    def _folder_index(self, folders):
+        """
+        Get the case-insensitive name index of a remote folder list, building it on first use
+        Returns: Dict of lower-cased folder name to folder object
+        """
+        # Keyed by id, the list itself is kept alongside so the id can't be reused while indexed
+        entry = self._folder_idx.get(id(folders))
+        if entry is None or entry[0] is not folders:
+            # Reversed so that the first of several equally named folders wins, as in a linear search
+            entry = (folders, {f['name'].lower(): f for f in reversed(folders)})
+            self._folder_idx[id(folders)] = entry
+        return entry[1]
+
+    def _find_folder(self, folders, folder_name):
+        """
+        Find a folder by name (case-insensitive) in a remote folder list
+        Returns: folder object or None
+        """
+        return self._folder_index(folders).get(folder_name.lower())
 
-        return project_infos
+    def _add_folder(self, folders, folder):
+        """
+        Append a newly created folder to a remote folder list, keeping its index up to date
+        """
+        folders.append(folder)
+        self._folder_index(folders).setdefault(folder['name'].lower(), folder)
 
-    def upload_file(self, project_id, project_infos, file_name, file_size, file):
+    def _get_folder_id(self, project_id, project_infos, file_name):
         """
-        Upload a file to the project
+        Get the id of the remote folder a file belongs in, creating missing folders on the way
 
         Params:
         project_id: the id of the project
-        file_name: how the file will be named
-        file_size: the size of the file in bytes
-        file: the file itself
+        project_infos: the project details, new folders are added to its folder tree
+        file_name: the file name, including its path relative to the project root
 
-        Returns: True on success, False on fail
+        Returns: folder id
         """
 
         # Set the folder_id to the id of the root folder
@@ -244,24 +412,32 @@ class OverleafClient(object):
             current_overleaf_folder = project_infos['rootFolder'][0]['folders']  # Set the current remote folder
 
             for local_folder in local_folders:
-                exists_on_remote = False
-                for remote_folder in current_overleaf_folder:
-                    # Check if the folder exists on remote, continue with the new folder structure
-                    if local_folder.lower() == remote_folder['name'].lower():
-                        exists_on_remote = True
-                        folder_id = remote_folder['_id']
-                        current_overleaf_folder = remote_folder['folders']
-                        break
+                # Check if the folder exists on remote, continue with the new folder structure
+                remote_folder = self._find_folder(current_overleaf_folder, local_folder)
                 # Create the folder if it doesn't exist
-                if not exists_on_remote:
-                    new_folder = self.create_folder(project_id, folder_id, local_folder)
-                    current_overleaf_folder.append(new_folder)
-                    folder_id = new_folder['_id']
-                    current_overleaf_folder = new_folder['folders']
+                if remote_folder is None:
+                    remote_folder = self.create_folder(project_id, folder_id, local_folder)
+                    if remote_folder is None:
+                        # Overleaf returned no folder, e.g. because it exists remotely but not in the cached tree
+                        raise reqs.HTTPError(
+                            "Folder %s could not be created in project %s" % (local_folder, project_id))
+                    self._add_folder(current_overleaf_folder, remote_folder)
+                folder_id = remote_folder['_id']
+                current_overleaf_folder = remote_folder['folders']
+
+        return folder_id
+
+    def _post_file(self, project_id, folder_id, file_name, file_size, file, qquuid=None):
+        """
+        Upload a file into an existing folder of the project
+        qquuid: the upload id, a fresh random one if not given
+
+        Returns: True on success, False on fail
+        """
         params = {
             "folder_id": folder_id,
             "_csrf": self._csrf,
-            "qquuid": str(uuid.uuid4()),
+            "qquuid": qquuid or uuid.uuid4().hex,
             "qqfilename": file_name,
             "qqtotalfilesize": file_size,
         }
@@ -270,9 +446,53 @@ class OverleafClient(object):
         }
 
         # Upload the file to the predefined folder
-        r = reqs.post(UPLOAD_URL.format(project_id), cookies=self._cookie, params=params, files=files)
+        r = self._session.post(UPLOAD_URL.format(project_id), params=params, files=files)
+
+        return r.status_code == 200 and _jloads(r)["success"]
+
+    def upload_file(self, project_id, project_infos, file_name, file_size, file):
+        """
+        Upload a file to the project
+
+        Params:
+        project_id: the id of the project
+        file_name: how the file will be named
+        file_size: the size of the file in bytes
+        file: the file itself
+
+        Returns: True on success, False on fail
+        """
+        with self._folder_lock:
+            folder_id = self._get_folder_id(project_id, project_infos, file_name)
+        return self._post_file(project_id, folder_id, file_name, file_size, file)
+
+    def upload_files(self, project_id, project_infos, files_iter, max_workers=HTTP_POOL_MAXSIZE):
+        """
+        Upload several files to the project concurrently
+
+        Params:
+        project_id: the id of the project
+        project_infos: the project details
+        files_iter: iterable of (file_name, file_size, file) tuples
+        max_workers: how many uploads run at the same time, more than the client's pool_maxsize open extra
+                     connections that are not kept alive
+
+        Returns: List of True on success, False on fail, in the order of files_iter
+        """
+        uploads = list(files_iter)
 
-        return r.status_code == str(200) and json.loads(r.content)["success"]
+        # Folders depend on their parents, so all of them are created sequentially before uploading
+        with self._folder_lock:
+            folder_ids = [self._get_folder_id(project_id, project_infos, file_name) for file_name, _, _ in uploads]
+
+        # Draw the random upload ids for all files at once
+        random_hex = os.urandom(16 * len(uploads)).hex()
+        qquuids = [random_hex[i:i + 32] for i in range(0, len(random_hex), 32)]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(
+                lambda args: self._post_file(project_id, *args),
+                [(folder_id, *upload, qquuid) for folder_id, upload, qquuid in zip(folder_ids, uploads, qquuids)]))
 
     def delete_file(self, project_id, project_infos, file_name):
         """
@@ -292,13 +512,13 @@ class OverleafClient(object):
             local_folders = file_name.split(PATH_SEP)[:-1]  # Remove last item since this is the file name
             current_overleaf_folder = project_infos['rootFolder'][0]['folders']  # Set the current remote folder
 
+            base_name = file_name.split(PATH_SEP)[-1]
+
             for local_folder in local_folders:
-                for remote_folder in current_overleaf_folder:
-                    if local_folder.lower() == remote_folder['name'].lower():
-                        file = next((v for v in remote_folder['docs'] if v['name'] == file_name.split(PATH_SEP)[-1]),
-                                    None)
-                        current_overleaf_folder = remote_folder['folders']
-                        break
+                remote_folder = self._find_folder(current_overleaf_folder, local_folder)
+                if remote_folder is not None:
+                    file = next((v for v in remote_folder['docs'] if v['name'] == base_name), None)
+                    current_overleaf_folder = remote_folder['folders']
         # File is in root folder
         else:
             file = next((v for v in project_infos['rootFolder'][0]['docs'] if v['name'] == file_name), None)
@@ -307,27 +527,20 @@ class OverleafClient(object):
         if file is None:
             return False
 
-        headers = {
-            "X-Csrf-Token": self._csrf
-        }
-
-        r = reqs.delete(DELETE_URL.format(project_id, file['_id']), cookies=self._cookie, headers=headers, json={})
+        r = self._session.delete(DELETE_URL.format(project_id, file['_id']), json={})
 
-        return r.status_code == str(204)
+        return r.status_code == 204
 
-    def download_pdf(self, project_id):
+    def download_pdf(self, project_id, download_path):
         """
-        Compiles and returns a project's PDF
+        Compiles a project and downloads its PDF
 
         Params:
         project_id: the id of the project
+        download_path: the directory the PDF is written to
 
-        Returns: PDF file name and content on success
+        Returns: path of the written PDF file on success, None on fail
         """
-        headers = {
-            "X-Csrf-Token": self._csrf
-        }
-
         body = {
             "check": "silent",
             "draft": False,
@@ -336,21 +549,34 @@ class OverleafClient(object):
             "stopOnFirstError": False
         }
 
-        r = reqs.post(COMPILE_URL.format(project_id), cookies=self._cookie, headers=headers, json=body)
+        r = self._session.post(COMPILE_URL.format(project_id), json=body)
 
         if not r.ok:
             raise reqs.HTTPError()
 
-        compile_result = json.loads(r.content)
+        compile_result = _jloads(r)
 
         if compile_result["status"] != "success":
             raise reqs.HTTPError()
 
         pdf_file = next(v for v in compile_result['outputFiles'] if v['type'] == 'pdf')
 
-        download_req = reqs.get(BASE_URL + pdf_file['url'], cookies=self._cookie, headers=headers)
-
-        if download_req.ok:
-            return pdf_file['path'], download_req.content
-
-        return None
+        with self._session.get(BASE_URL + pdf_file['url'], stream=True) as download_req:
+            if not download_req.ok:
+                return None
+
+            # Copy straight from the socket to disk instead of buffering the whole PDF. The copy goes to a temporary
+            # file next to the target first, so a failed download leaves a previous PDF untouched
+            download_req.raw.decode_content = True
+            file_path = os.path.join(download_path, pdf_file['path'])
+            part_path = file_path + '.part'
+            f = open(part_path, 'wb')
+            try:
+                with f:
+                    shutil.copyfileobj(download_req.raw, f, length=DOWNLOAD_CHUNK_SIZE)
+            except BaseException:
+                os.remove(part_path)
+                raise
+            os.replace(part_path, file_path)
+
+        return file_path
@@ -13,24 +13,28 @@
 
 import click
 import os
-from yaspin import yaspin
-import pickle
-import zipfile
+import asyncio
+import json
 import io
-import dateutil.parser
-import glob
-import fnmatch
+import calendar
+import zipfile
+import re
 import traceback
-from pathlib import Path
+import functools
+import shutil
 
 try:
     # Import for pip installation / wheel
     from olsync.olclient import OverleafClient
-    import olsync.olbrowserlogin as olbrowserlogin
 except ImportError:
     # Import for development
     from olclient import OverleafClient
-    import olbrowserlogin
+
+COPY_CHUNK_SIZE = 1 << 16  # Bytes read at once when comparing or copying files
+MTIME_TOLERANCE = 2  # Seconds two modification times may differ and still count as the same
+ZIP_CACHE_ENTRIES = 32  # Number of decompressed project files kept in memory
+ZIP_CACHE_ENTRY_SIZE = 1 << 20  # Only project files up to this size are kept decompressed
+DEFAULT_CONCURRENCY = 8  # Files transferred at the same time unless --max-concurrency says otherwise
 
 
 @click.group(invoke_without_command=True)
@@ -46,19 +50,25 @@ except ImportError:
 @click.option('-i', '--olignore', 'olignore_path', default=".olignore", type=click.Path(exists=False),
               help="Path to the .olignore file relative to sync path (ignored if syncing from remote to local). See "
                    "fnmatch / unix filename pattern matching for information on how to use it.")
+@click.option('-c', '--max-concurrency', 'max_concurrency', default=DEFAULT_CONCURRENCY, show_default=True,
+              type=click.IntRange(min=1),
+              help="How many files are transferred at the same time. Use 1 on slow connections.")
+@click.option('--on-deleted', 'on_deleted', default="ask", show_default=True,
+              type=click.Choice(['ask', 'delete', 'restore', 'ignore']),
+              help="What to do with deleted files when syncing one way only. `ask` lists them and asks once.")
 @click.option('-v', '--verbose', 'verbose', is_flag=True, help="Enable extended error logging.")
 @click.version_option(package_name='overleaf-sync')
 @click.pass_context
-def main(ctx, local, remote, project_name, cookie_path, sync_path, olignore_path, verbose):
+def main(ctx, local, remote, project_name, cookie_path, sync_path, olignore_path, max_concurrency, on_deleted,
+         verbose):
     if ctx.invoked_subcommand is None:
         if not os.path.isfile(cookie_path):
             raise click.ClickException(
                 "Persisted Overleaf cookie not found. Please login or check store path.")
 
-        with open(cookie_path, 'rb') as f:
-            store = pickle.load(f)
+        store = load_store(cookie_path)
 
-        overleaf_client = OverleafClient(store["cookie"], store["csrf"])
+        overleaf_client = OverleafClient(store["cookie"], store["csrf"], pool_maxsize=max_concurrency)
 
         # Change the current directory to the specified sync path
         os.chdir(sync_path)
@@ -79,8 +89,7 @@ def main(ctx, local, remote, project_name, cookie_path, sync_path, olignore_path
             verbose)
 
         zip_file = execute_action(
-            lambda: zipfile.ZipFile(io.BytesIO(
-                overleaf_client.download_project(project["id"]))),
+            lambda: zipfile.ZipFile(overleaf_client.download_project(project["id"])),
             "Downloading project",
             "Project downloaded successfully.",
             "Project could not be downloaded.",
@@ -91,37 +100,34 @@ def main(ctx, local, remote, project_name, cookie_path, sync_path, olignore_path
         else:
             click.echo("\n.olignore: using %s to filter items" % olignore_path)
 
+        # Deleted files are only looked for in one-way syncs
         sync = not (local or remote)
 
+        import dateutil.parser
+
+        local_names = olignore_keep_list(olignore_path)
+        remote_ts = dateutil.parser.isoparse(project["lastUpdated"]).timestamp()
+
         if remote or sync:
+            # Fresh endpoints per direction, local files change in between
+            remote_endpoint = RemoteEndpoint(overleaf_client, project, project_infos, zip_file, remote_ts)
+            local_endpoint = LocalEndpoint(local_names)
             sync_func(
-                files_from=zip_file.namelist(),
-                deleted_files=[f for f in olignore_keep_list(olignore_path) if f not in zip_file.namelist() and not sync],
-                create_file_at_to=lambda name: write_file(name, zip_file.read(name)),
-                delete_file_at_to=lambda name: delete_file(name),
-                create_file_at_from=lambda name: overleaf_client.upload_file(
-                    project["id"], project_infos, name, os.path.getsize(name), open(name, 'rb')),
-                from_exists_in_to=lambda name: os.path.isfile(name),
-                from_equal_to_to=lambda name: open(name, 'rb').read() == zip_file.read(name),
-                from_newer_than_to=lambda name: dateutil.parser.isoparse(project["lastUpdated"]).timestamp() >
-                                                os.path.getmtime(name),
-                from_name="remote",
-                to_name="local",
+                src=remote_endpoint,
+                dst=local_endpoint,
+                deleted_files=[] if sync else [f for f in local_endpoint.names if f not in remote_endpoint.name_set],
+                max_concurrency=max_concurrency,
+                on_deleted=on_deleted,
                 verbose=verbose)
         if local or sync:
+            remote_endpoint = RemoteEndpoint(overleaf_client, project, project_infos, zip_file, remote_ts)
+            local_endpoint = LocalEndpoint(local_names)
             sync_func(
-                files_from=olignore_keep_list(olignore_path),
-                deleted_files=[f for f in zip_file.namelist() if f not in olignore_keep_list(olignore_path) and not sync],
-                create_file_at_to=lambda name: overleaf_client.upload_file(
-                    project["id"], project_infos, name, os.path.getsize(name), open(name, 'rb')),
-                delete_file_at_to=lambda name: overleaf_client.delete_file(project["id"], project_infos, name),
-                create_file_at_from=lambda name: write_file(name, zip_file.read(name)),
-                from_exists_in_to=lambda name: name in zip_file.namelist(),
-                from_equal_to_to=lambda name: open(name, 'rb').read() == zip_file.read(name),
-                from_newer_than_to=lambda name: os.path.getmtime(name) > dateutil.parser.isoparse(
-                    project["lastUpdated"]).timestamp(),
-                from_name="local",
-                to_name="remote",
+                src=local_endpoint,
+                dst=remote_endpoint,
+                deleted_files=[] if sync else [f for f in remote_endpoint.names if f not in local_endpoint.name_set],
+                max_concurrency=max_concurrency,
+                on_deleted=on_deleted,
                 verbose=verbose)
 
 
@@ -145,6 +151,8 @@ def login(cookie_path, verbose):
               help="Relative path to load the persisted Overleaf cookie.")
 @click.option('-v', '--verbose', 'verbose', is_flag=True, help="Enable extended error logging.")
 def list_projects(cookie_path, verbose):
+    import dateutil.parser
+
     def query_projects():
         for index, p in enumerate(sorted(overleaf_client.all_projects(), key=lambda x: x['lastUpdated'], reverse=True)):
             if not index:
@@ -156,8 +164,7 @@ def list_projects(cookie_path, verbose):
         raise click.ClickException(
             "Persisted Overleaf cookie not found. Please login or check store path.")
 
-    with open(cookie_path, 'rb') as f:
-        store = pickle.load(f)
+    store = load_store(cookie_path)
 
     overleaf_client = OverleafClient(store["cookie"], store["csrf"])
 
@@ -185,22 +192,14 @@ def download_pdf(project_name, download_path, cookie_path, verbose):
             "Project could not be queried.",
             verbose)
 
-        file_name, content = overleaf_client.download_pdf(project["id"])
-
-        if file_name and content:
-            # Change the current directory to the specified sync path
-            os.chdir(download_path)
-            open(file_name, 'wb').write(content)
-
-        return True
+        return overleaf_client.download_pdf(project["id"], download_path) is not None
 
     click.echo('='*40)
     if not os.path.isfile(cookie_path):
         raise click.ClickException(
             "Persisted Overleaf cookie not found. Please login or check store path.")
 
-    with open(cookie_path, 'rb') as f:
-        store = pickle.load(f)
+    store = load_store(cookie_path)
 
     overleaf_client = OverleafClient(store["cookie"], store["csrf"])
 
@@ -212,14 +211,40 @@ def download_pdf(project_name, download_path, cookie_path, verbose):
 
 
 def login_handler(path):
+    # Qt is only needed for logging in, don't load it for every command
+    try:
+        # Import for pip installation / wheel
+        import olsync.olbrowserlogin as olbrowserlogin
+    except ImportError:
+        # Import for development
+        import olbrowserlogin
+
     store = olbrowserlogin.login()
     if store is None:
         return False
-    with open(path, 'wb+') as f:
-        pickle.dump(store, f)
+    save_store(path, store)
     return True
 
 
+def save_store(path, store):
+    with open(path, 'w') as f:
+        json.dump({"cookie": dict(store["cookie"]), "csrf": store["csrf"]}, f)
+
+
+def load_store(path):
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    # Cookie files of older versions are pickled, convert them to JSON on first use
+    if content[:1] == b'\x80':
+        import pickle
+        store = pickle.loads(content)
+        save_store(path, store)
+        return store
+
+    return json.loads(content)
+
+
 def delete_file(path):
     _dir = os.path.dirname(path)
     if _dir == path:
@@ -231,26 +256,132 @@ def delete_file(path):
         os.remove(path)
 
 
-def write_file(path, content):
+def write_file(path, stream):
     _dir = os.path.dirname(path)
     if _dir == path:
         return
 
-    # path is a file
-    if _dir != '' and not os.path.exists(_dir):
-        os.makedirs(_dir)
+    # path is a file, other files may be written into the same new folder concurrently
+    if _dir != '':
+        os.makedirs(_dir, exist_ok=True)
 
     with open(path, 'wb+') as f:
-        f.write(content)
+        shutil.copyfileobj(stream, f, COPY_CHUNK_SIZE)
+
+
+class LocalEndpoint(object):
+    """
+    The files of the sync folder as one side of a sync
+    """
+    name = "local"
+
+    def __init__(self, names):
+        self.names = names  # Files to sync, see olignore_keep_list
+        self.name_set = set(names)
+        # One stat per file for all checks
+        self._stat = functools.lru_cache(maxsize=None)(os.stat)
+
+    def exists(self, name):
+        return os.path.isfile(name)
+
+    def size(self, name):
+        return self._stat(name).st_size
+
+    def mtime(self, name):
+        return self._stat(name).st_mtime
+
+    def open(self, name):
+        return open(name, 'rb')
+
+    def write(self, name, stream, size):
+        write_file(name, stream)
+
+    def delete(self, name):
+        delete_file(name)
+
+
+class RemoteEndpoint(object):
+    """
+    The files of the Overleaf project as one side of a sync, read from the downloaded zip file
+    """
+    name = "remote"
+
+    def __init__(self, overleaf_client, project, project_infos, zip_file, remote_ts):
+        self._overleaf_client = overleaf_client
+        self._project = project
+        self._project_infos = project_infos
+        self._zip_file = zip_file
+        self._zip_infos = {info.filename: info for info in zip_file.infolist()}
+        # Per-file modification times from the zip, which Overleaf stamps in UTC. Capped at the project's last update
+        # since an archive may stamp its entries with the time it was created
+        self._mtimes = {info.filename: min(calendar.timegm(info.date_time), remote_ts)
+                        for info in self._zip_infos.values()}
+        # Small files are often read twice, to compare and then to copy them, so keep the last ones decompressed
+        self._read_cached = functools.lru_cache(maxsize=ZIP_CACHE_ENTRIES)(zip_file.read)
+        self.names = zip_file.namelist()
+        self.name_set = set(self.names)
+
+    def exists(self, name):
+        return name in self.name_set
+
+    def size(self, name):
+        return self._zip_infos[name].file_size
+
+    def mtime(self, name):
+        return self._mtimes[name]
+
+    def open(self, name):
+        if self.size(name) <= ZIP_CACHE_ENTRY_SIZE:
+            return io.BytesIO(self._read_cached(name))
+        return self._zip_file.open(name)
+
+    def write(self, name, stream, size):
+        return self._overleaf_client.upload_file(self._project["id"], self._project_infos, name, size, stream)
+
+    def delete(self, name):
+        return self._overleaf_client.delete_file(self._project["id"], self._project_infos, name)
+
+
+def copy_file(src, dst, name):
+    """
+    Copy a file from one endpoint to the other, streaming it instead of reading it into memory at once.
+    """
+    with src.open(name) as stream:
+        return dst.write(name, stream, src.size(name))
+
+
+def files_equal(src, dst, name):
+    """
+    Check whether a file is the same on both endpoints.
+    Only compares contents if neither the size nor the modification time settle it.
+    """
+    if src.size(name) != dst.size(name):
+        return False
+    # Same size and last modified together, treat as already synced
+    if abs(src.mtime(name) - dst.mtime(name)) < MTIME_TOLERANCE:
+        return True
+    with src.open(name) as a, dst.open(name) as b:
+        return streams_equal(a, b)
+
+
+def streams_equal(a, b):
+    """
+    Compare two binary streams chunk by chunk, stopping at the first difference.
+    """
+    while True:
+        chunk = a.read(COPY_CHUNK_SIZE)
+        if chunk != b.read(COPY_CHUNK_SIZE):
+            return False
+        if not chunk:
+            return True
 
 
-def sync_func(files_from, deleted_files, create_file_at_to, delete_file_at_to, create_file_at_from, from_exists_in_to,
-              from_equal_to_to, from_newer_than_to, from_name,
-              to_name, verbose=False):
+def sync_func(src, dst, deleted_files, max_concurrency=DEFAULT_CONCURRENCY, on_deleted="ask", verbose=False):
+    from_name = src.name
+    to_name = dst.name
     click.echo("\nSyncing files from [%s] to [%s]" % (from_name, to_name))
     click.echo('=' * 40)
 
-    newly_add_list = []
     update_list = []
     delete_list = []
     restore_list = []
@@ -258,99 +389,162 @@ def sync_func(files_from, deleted_files, create_file_at_to, delete_file_at_to, c
     not_sync_list = []
     synced_list = []
 
-    for name in files_from:
-        if from_exists_in_to(name):
-            if not from_equal_to_to(name):
-                if not from_newer_than_to(name) and not click.confirm(
-                        '\n-> Warning: last-edit time stamp of file <%s> from [%s] is older than [%s].\nContinue to '
-                        'overwrite with an older version?' % (name, from_name, to_name)):
-                    not_sync_list.append(name)
-                    continue
-
-                update_list.append(name)
-            else:
-                synced_list.append(name)
+    # Diff the listings with set operations, files outside the destination's listing (e.g. ignored local
+    # files) may still exist there though
+    maybe_new = src.name_set - dst.name_set
+    newly_add_list = [name for name in src.names if name in maybe_new and not dst.exists(name)]
+    new_set = set(newly_add_list)
+
+    # Only files on both sides need to be compared, stats and reads run in worker threads so they overlap
+    both = [name for name in src.names if name not in new_set]
+    equal_results = run_concurrently(lambda name: files_equal(src, dst, name), both, max_concurrency)
+    check_results(equal_results, "\n[ERROR] An error occurred while comparing file(s) on [%s] and [%s]"
+                  % (from_name, to_name), verbose)
+
+    for name, equal in zip(both, equal_results):
+        if not equal:
+            if not src.mtime(name) > dst.mtime(name) and not click.confirm(
+                    '\n-> Warning: last-edit time stamp of file <%s> from [%s] is older than [%s].\nContinue to '
+                    'overwrite with an older version?' % (name, from_name, to_name)):
+                not_sync_list.append(name)
+                continue
+
+            update_list.append(name)
         else:
-            newly_add_list.append(name)
-
-    for name in deleted_files:
-        delete_choice = click.prompt(
-            '\n-> Warning: file <%s> does not exist on [%s] anymore (but it still exists on [%s]).'
-            '\nShould the file be [d]eleted, [r]estored or [i]gnored?' % (name, from_name, to_name),
-            default="i",
-            type=click.Choice(['d', 'r', 'i']))
-        if delete_choice == "d":
-            delete_list.append(name)
-        elif delete_choice == "r":
-            restore_list.append(name)
-        elif delete_choice == "i":
-            not_restored_list.append(name)
+            synced_list.append(name)
+
+    if on_deleted == "ask":
+        delete_list, restore_list, not_restored_list = ask_deleted(deleted_files, from_name, to_name)
+    elif on_deleted == "delete":
+        delete_list = list(deleted_files)
+    elif on_deleted == "restore":
+        restore_list = list(deleted_files)
+    else:
+        not_restored_list = list(deleted_files)
 
     click.echo(
         "\n[NEW] Following new file(s) created on [%s]" % to_name)
-    for name in newly_add_list:
-        click.echo("\t%s" % name)
-        try:
-            create_file_at_to(name)
-        except:
-            if verbose:
-                print(traceback.format_exc())
-            raise click.ClickException("\n[ERROR] An error occurred while creating new file(s) on [%s]" % to_name)
+    if newly_add_list:
+        click.echo("\n".join("\t%s" % name for name in newly_add_list))
+    check_results(run_concurrently(lambda name: copy_file(src, dst, name), newly_add_list, max_concurrency),
+                  "\n[ERROR] An error occurred while creating new file(s) on [%s]" % to_name, verbose)
 
     click.echo(
         "\n[NEW] Following new file(s) created on [%s]" % from_name)
-    for name in restore_list:
-        click.echo("\t%s" % name)
-        try:
-            create_file_at_from(name)
-        except:
-            if verbose:
-                print(traceback.format_exc())
-            raise click.ClickException("\n[ERROR] An error occurred while creating new file(s) on [%s]" % from_name)
+    if restore_list:
+        click.echo("\n".join("\t%s" % name for name in restore_list))
+    check_results(run_concurrently(lambda name: copy_file(dst, src, name), restore_list, max_concurrency),
+                  "\n[ERROR] An error occurred while creating new file(s) on [%s]" % from_name, verbose)
 
     click.echo(
         "\n[UPDATE] Following file(s) updated on [%s]" % to_name)
-    for name in update_list:
-        click.echo("\t%s" % name)
-        try:
-            create_file_at_to(name)
-        except:
-            if verbose:
-                print(traceback.format_exc())
-            raise click.ClickException("\n[ERROR] An error occurred while updating file(s) on [%s]" % to_name)
+    if update_list:
+        click.echo("\n".join("\t%s" % name for name in update_list))
+    check_results(run_concurrently(lambda name: copy_file(src, dst, name), update_list, max_concurrency),
+                  "\n[ERROR] An error occurred while updating file(s) on [%s]" % to_name, verbose)
 
     click.echo(
         "\n[DELETE] Following file(s) deleted on [%s]" % to_name)
-    for name in delete_list:
-        click.echo("\t%s" % name)
-        try:
-            delete_file_at_to(name)
-        except:
-            if verbose:
-                print(traceback.format_exc())
-            raise click.ClickException("\n[ERROR] An error occurred while creating new file(s) on [%s]" % to_name)
+    if delete_list:
+        click.echo("\n".join("\t%s" % name for name in delete_list))
+    check_results(run_concurrently(dst.delete, delete_list, max_concurrency),
+                  "\n[ERROR] An error occurred while creating new file(s) on [%s]" % to_name, verbose)
 
     click.echo(
         "\n[SYNC] Following file(s) are up to date")
-    for name in synced_list:
-        click.echo("\t%s" % name)
+    if synced_list:
+        click.echo("\n".join("\t%s" % name for name in synced_list))
 
     click.echo(
         "\n[SKIP] Following file(s) on [%s] have not been synced to [%s]" % (from_name, to_name))
-    for name in not_sync_list:
-        click.echo("\t%s" % name)
+    if not_sync_list:
+        click.echo("\n".join("\t%s" % name for name in not_sync_list))
 
     click.echo(
         "\n[SKIP] Following file(s) on [%s] have not been synced to [%s]" % (to_name, from_name))
-    for name in not_restored_list:
-        click.echo("\t%s" % name)
+    if not_restored_list:
+        click.echo("\n".join("\t%s" % name for name in not_restored_list))
 
     click.echo("")
     click.echo("✅  Synced files from [%s] to [%s]" % (from_name, to_name))
     click.echo("")
 
 
+def ask_deleted(deleted_files, from_name, to_name):
+    """
+    List the deleted files once and ask which of them to delete and which to restore, the rest is ignored.
+    Returns the lists of files to delete, to restore and to ignore.
+    """
+    if not deleted_files:
+        return [], [], []
+
+    click.echo("\n-> Warning: following file(s) do not exist on [%s] anymore (but they still exist on [%s])."
+               % (from_name, to_name))
+    click.echo("\n".join("\t%d: %s" % (i, name) for i, name in enumerate(deleted_files, 1)))
+    click.echo("Select files by number or pattern, separated by commas (e.g. `1,3,figures/*`, or `*` for all).")
+
+    # Invalid selections raise click.BadParameter, which makes click.prompt ask again
+    delete_list = click.prompt("Which file(s) should be [d]eleted?", default="", show_default=False,
+                               value_proc=lambda selection: select_files(deleted_files, selection))
+    delete_set = set(delete_list)
+    remaining = [name for name in deleted_files if name not in delete_set]
+    # Numbers keep referring to the list shown above, files picked for deletion are left out
+    restore_set = set(click.prompt("Which file(s) should be [r]estored?", default="", show_default=False,
+                                   value_proc=lambda selection: select_files(deleted_files, selection))
+                      ) - delete_set if remaining else set()
+    restore_list = [name for name in remaining if name in restore_set]
+    return delete_list, restore_list, [name for name in remaining if name not in restore_set]
+
+
+def select_files(names, selection):
+    """
+    The names picked by a comma-separated selection of 1-based numbers (into names) and fnmatch patterns.
+    """
+    import fnmatch
+
+    picked = set()
+    for token in selection.split(","):
+        token = token.strip()
+        if token.isdigit():
+            if not 1 <= int(token) <= len(names):
+                raise click.BadParameter("there is no file number %s" % token)
+            picked.add(names[int(token) - 1])
+        elif token:
+            picked.update(fnmatch.filter(names, token))
+    return [name for name in names if name in picked]
+
+
+def run_concurrently(func, names, max_concurrency):
+    """
+    Call func for every name in worker threads, with at most max_concurrency calls running at once.
+    Returns the results in the order of names, exceptions are returned instead of raised.
+    """
+    async def run_all():
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run(name):
+            async with semaphore:
+                return await asyncio.to_thread(func, name)
+
+        return await asyncio.gather(*[run(name) for name in names], return_exceptions=True)
+
+    if not names:
+        return []
+    return asyncio.run(run_all())
+
+
+def check_results(results, error_message, verbose=False):
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        if verbose:
+            for error in errors:
+                print("".join(traceback.format_exception(type(error), error, error.__traceback__)))
+        raise click.ClickException(error_message)
+
+
 def execute_action(action, progress_message, success_message, fail_message, verbose_error_logging=False):
+    from yaspin import yaspin
+
     with yaspin(text=progress_message, color="green") as spinner:
         try:
             success = action()
@@ -370,27 +564,57 @@ def execute_action(action, progress_message, success_message, fail_message, verb
         return success
 
 
+def compile_ignore_patterns(ignore_pattern):
+    """
+    Combine fnmatch patterns into a single regex, so each path is matched once instead of once per pattern.
+    Returns None if there is nothing to ignore.
+    """
+    import fnmatch
+
+    ignore_pattern = [os.path.normcase(p) for p in ignore_pattern if p]
+    if not ignore_pattern:
+        return None
+    return re.compile('|'.join('(?:%s)' % fnmatch.translate(p) for p in ignore_pattern))
+
+
 def olignore_keep_list(olignore_path):
     """
     The list of files to keep synced, with support for sub-folders.
     Should only be called when syncing from local to remote.
     """
-    # get list of files recursively (ignore .* files)
-    files = glob.glob('**', recursive=True)
-
     #click.echo("="*40)
     if not os.path.isfile(olignore_path):
         #click.echo("\nNotice: .olignore file does not exist, will sync all items.")
-        keep_list = files
+        ignore_pattern = []
     else:
         #click.echo("\n.olignore: using %s to filter items" % olignore_path)
         with open(olignore_path, 'r') as f:
             ignore_pattern = f.read().splitlines()
 
-        keep_list = [f for f in files if not any(
-            fnmatch.fnmatch(f, ignore) for ignore in ignore_pattern)]
+    pattern_re = compile_ignore_patterns(ignore_pattern)
+    # Folders whose contents are all ignored are not walked at all: those matching a pattern that ends in *, and
+    # those named by a folder pattern (out/, out/* or out/**)
+    folder_pattern = [p for p in ignore_pattern if p.endswith('*')]
+    for p in ignore_pattern:
+        p = p.rstrip('*')
+        if len(p) > 1 and p.endswith('/'):
+            folder_pattern.append(p[:-1])
+    folder_re = compile_ignore_patterns(folder_pattern)
+
+    keep_list = []
+    # get list of files recursively (ignore .* files), following symlinks like glob does
+    for root, dirnames, filenames in os.walk('.', followlinks=True):
+        prefix = '' if root == '.' else root[2:] + os.sep
+        # Listed names use / as separator, built once per folder
+        posix_prefix = prefix if os.sep == '/' else prefix.replace(os.sep, '/')
+        dirnames[:] = [d for d in dirnames if not d.startswith('.') and not (
+                folder_re and folder_re.match(os.path.normcase(prefix + d)))]
+        for name in filenames:
+            if name.startswith('.'):
+                continue
+            if pattern_re is None or not pattern_re.match(os.path.normcase(prefix + name)):
+                keep_list.append(posix_prefix + name)
 
-    keep_list = [Path(item).as_posix() for item in keep_list if not os.path.isdir(item)]
     return keep_list
 
 